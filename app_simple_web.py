@@ -3,7 +3,10 @@ app_simple_web.py — FastAPI backend for the UFO PID workshop
 
 Endpoints:
 - POST /control : deterministic plant+PID step (called frequently by frontend)
-- POST /tune    : 1-shot agent suggestion (1 model call)
+- POST /rollout : deterministic trajectory for many steps in one call
+                  (the frontend plays it back instead of calling /control)
+- POST /tune    : 1-shot agent suggestion (1 model call; concurrent clicks
+                  arriving within a short window share one batched call)
 
 Important workshop rule:
 - The animation loop NEVER calls the LLM.
@@ -11,19 +14,94 @@ Important workshop rule:
 
 from __future__ import annotations
 
-from typing import Any, Dict, Literal
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Literal, NamedTuple
 
+import msgspec
+import orjson
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 
-from ufo_sim import UFOState, step_ufo
-from agent_tuner import tune_gains
+from ufo_sim import UFOState, UFOStateMS, rollout_trajectory, step_ufo_ms
+from agent_tuner import can_batch, tune_gains_many
 
 load_dotenv()
 
-app = FastAPI(title="UFO PID Workshop Backend")
+# /tune coalescing: requests arriving within this window share one model call
+TUNE_BATCH_WINDOW_S = 0.1
+TUNE_BATCH_MAX = 8
+TUNE_TIMEOUT_S = 120.0
+
+
+class _PendingTune(NamedTuple):
+    dt: float
+    theta0: float
+    style: str
+    future: "asyncio.Future[Dict[str, Any]]"
+
+
+async def _run_tune_batch(style: str, items: List[_PendingTune]) -> None:
+    cases = [(it.dt, it.theta0) for it in items]
+    try:
+        outs = await tune_gains_many(cases, style)
+    except Exception as exc:
+        outs = [exc] * len(items)
+    # Each click gets its own result or error (one failed case fails only itself)
+    for it, out in zip(items, outs):
+        if it.future.done():
+            continue
+        if isinstance(out, BaseException):
+            it.future.set_exception(out)
+        else:
+            it.future.set_result(out)
+
+
+async def _tune_batch_worker(queue: "asyncio.Queue[_PendingTune]") -> None:
+    loop = asyncio.get_running_loop()
+    tasks: "set[asyncio.Task]" = set()
+    while True:
+        batch = [await queue.get()]
+        # No batching possible (show_raw_output): dispatch now, skip the window
+        deadline = loop.time() + (TUNE_BATCH_WINDOW_S if can_batch() else 0.0)
+        while len(batch) < TUNE_BATCH_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        by_style: Dict[str, List[_PendingTune]] = {}
+        for item in batch:
+            by_style.setdefault(item.style, []).append(item)
+        for style, items in by_style.items():
+            task = asyncio.create_task(_run_tune_batch(style, items))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Queue and worker live on the serving loop (one pair per app startup)
+    app.state.tune_queue = asyncio.Queue()
+    app.state.tune_worker = asyncio.create_task(_tune_batch_worker(app.state.tune_queue))
+    yield
+    app.state.tune_worker.cancel()
+    try:
+        await app.state.tune_worker
+    except asyncio.CancelledError:
+        pass
+
+
+# JSON encoding: /control (msgspec) and /rollout (orjson) build their own bytes.
+# Other endpoints declare a return type, so FastAPI serializes them straight
+# to bytes with Pydantic. No default_response_class (e.g. ORJSONResponse,
+# deprecated in recent FastAPI): a custom class turns that fast path off.
+app = FastAPI(title="UFO PID Workshop Backend", lifespan=lifespan)
 
 # Allow simple local dev (frontend served on another port)
 app.add_middleware(
@@ -39,6 +117,8 @@ app.add_middleware(
 # Deterministic control endpoint
 # -----------------------------
 class ControlRequest(BaseModel):
+    """Public schema of the /control body (OpenAPI docs only, see ControlRequestMS)."""
+
     dt: float
     theta_ref: float = 0.0  # radians
 
@@ -49,13 +129,62 @@ class ControlRequest(BaseModel):
     state: UFOState
 
 
-@app.post("/control")
-def control(req: ControlRequest) -> Dict[str, Any]:
+class ControlRequestMS(msgspec.Struct):
+    """What /control actually decodes: same fields, msgspec instead of Pydantic."""
+
+    dt: float
+    kp: float
+    ki: float
+    kd: float
+    state: UFOStateMS
+    theta_ref: float = 0.0  # radians
+
+
+class ControlResponse(BaseModel):
+    """Public schema of the /control reply (OpenAPI docs only, see ControlResponseMS)."""
+
+    state: UFOState
+    error: float
+    u: float
+
+
+class ControlResponseMS(msgspec.Struct):
+    """What /control actually encodes: one typed C-side pass, no intermediate dict."""
+
+    state: UFOStateMS
+    error: float
+    u: float
+
+
+_control_decoder = msgspec.json.Decoder(ControlRequestMS)
+_json_encoder = msgspec.json.Encoder()
+
+_control_schema = ControlRequest.model_json_schema()
+_control_schema["properties"]["state"] = _control_schema.pop("$defs")["UFOState"]
+
+
+@app.post(
+    "/control",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": _control_schema}},
+        }
+    },
+    responses={200: {"model": ControlResponse}},
+)
+async def control(request: Request) -> Response:
     """\
     Deterministic control + plant step. NO LLM CALLS.
-    Called frequently by the frontend animation loop.
+    Called frequently by the frontend animation loop, so the body is decoded
+    and the reply encoded with msgspec, bypassing Pydantic/FastAPI encoding.
     """
-    next_state, e, u = step_ufo(
+    try:
+        req = _control_decoder.decode(await request.body())
+    except msgspec.DecodeError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+    next_state, e, u = step_ufo_ms(
         dt=req.dt,
         state=req.state,
         kp=req.kp,
@@ -63,7 +192,55 @@ def control(req: ControlRequest) -> Dict[str, Any]:
         kd=req.kd,
         theta_ref=req.theta_ref,
     )
-    return {"state": next_state.model_dump(), "error": e, "u": u}
+    body = _json_encoder.encode(ControlResponseMS(state=next_state, error=e, u=u))
+    return Response(content=body, media_type="application/json")
+
+
+ROLLOUT_MAX_STEPS = 20_000  # about 2 MB of JSON for the 5 arrays
+
+
+class RolloutRequest(BaseModel):
+    dt: float = Field(..., ge=1e-3, le=1.0)
+
+    kp: float
+    ki: float
+    kd: float
+
+    theta0: float = 3.0  # radians
+    omega0: float = 0.0  # rad/s
+    # Controller memory, so a rollout can continue from a running simulation
+    integ0: float = 0.0
+    e_prev0: float = 0.0
+
+    seconds: float = Field(6.0, gt=0.0, le=120.0)
+
+    @model_validator(mode="after")
+    def _cap_steps(self) -> "RolloutRequest":
+        if self.seconds / self.dt > ROLLOUT_MAX_STEPS:
+            raise ValueError(f"seconds / dt must be <= {ROLLOUT_MAX_STEPS} steps")
+        return self
+
+
+@app.post("/rollout")
+def rollout(req: RolloutRequest) -> Response:
+    """\
+    Deterministic trajectory (theta_ref = 0). NO LLM CALLS.
+    Returns arrays theta, omega, integ, error, u with one entry per step,
+    so the frontend pays one HTTP round-trip for the whole animation.
+    """
+    traj = rollout_trajectory(
+        dt=req.dt,
+        kp=req.kp,
+        ki=req.ki,
+        kd=req.kd,
+        seconds=req.seconds,
+        theta0=req.theta0,
+        omega0=req.omega0,
+        integ0=req.integ0,
+        e_prev0=req.e_prev0,
+    )
+    body = orjson.dumps(traj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return Response(content=body, media_type="application/json")
 
 
 # -----------------------------
@@ -75,10 +252,23 @@ class TuneRequest(BaseModel):
 
 
 @app.post("/tune")
-def tune(req: TuneRequest, style: Literal["no_tools", "agent_tool"] = "agent_tool") -> Dict[str, Any]:
+async def tune(
+    req: TuneRequest,
+    request: Request,
+    style: Literal["no_tools", "agent_tool"] = "agent_tool",
+) -> Dict[str, Any]:
     """\
-    One OpenAI call per click.
+    One OpenAI call per click (or per batch of concurrent clicks).
     style=no_tools   : LLM must propose gains.
     style=agent_tool : model may call compute_pid_gains(theta0, dt).
     """
-    return tune_gains(dt=req.dt, theta0=req.theta0, style=style)
+    worker = getattr(request.app.state, "tune_worker", None)
+    if worker is None or worker.done():
+        raise HTTPException(status_code=503, detail="tune worker is not running")
+
+    future: "asyncio.Future[Dict[str, Any]]" = asyncio.get_running_loop().create_future()
+    await request.app.state.tune_queue.put(_PendingTune(req.dt, req.theta0, style, future))
+    try:
+        return await asyncio.wait_for(future, TUNE_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="tune timed out")
@@ -7,7 +7,9 @@
 //     (2) "Auto-tune"      -> up to N model calls (N=3 by default)
 // - The agent backend is served at http://127.0.0.1:9500
 //
-// Frontend loop calls /control frequently to advance the deterministic plant.
+// Frontend loop advances the deterministic plant every tick: while playing it
+// plays back a trajectory fetched once from /rollout; while paused it calls
+// /control.
 //
 // Concepts for students:
 // - Agent.instructions = "global rules" (SYSTEM)
@@ -97,6 +99,19 @@ let errBuf = [];
 let uBuf = [];
 const BUF_MAX = 220;
 
+// trajectory playback (see /rollout below)
+const ROLLOUT_SECONDS = 6.0;
+// dt range /rollout accepts (RolloutRequest.dt). Both endpoints get the clamped
+// value, so an empty or out-of-range dt field keeps the simulation running.
+const DT_MIN = 1e-3, DT_MAX = 1.0;
+const simDt = () => {
+  const v = Number(dtIn.value);
+  return Number.isFinite(v) ? clamp(v, DT_MIN, DT_MAX) : DT_MIN;
+};
+let traj = null;
+let trajIdx = 0;
+let trajGen = 0;
+
 // -----------------------------
 // UI wiring
 // -----------------------------
@@ -106,8 +121,12 @@ function syncSliderText(){
   kdVal.textContent = fmt(Number(kd.value), 1);
 }
 
-[kp, ki, kd].forEach(inp => inp.addEventListener("input", syncSliderText));
+[kp, ki, kd].forEach(inp => inp.addEventListener("input", () => {
+  syncSliderText();
+  invalidateTrajectory();
+}));
 syncSliderText();
+dtIn.addEventListener("input", () => invalidateTrajectory());
 
 pillTask.textContent = "System: UFO";
 pillMode.textContent = `Mode: ${tuneStyle.value}`;
@@ -118,6 +137,7 @@ tuneStyle.addEventListener("change", () => {
 });
 
 function setPlaying(on){
+  invalidateTrajectory();
   playing = on;
   state.paused = !on;
   playBtn.textContent = on ? "Pause" : "Play";
@@ -125,6 +145,7 @@ function setPlaying(on){
 setPlaying(false);
 
 function resetSim(){
+  invalidateTrajectory();
   state.theta = Number(theta0In.value);
   state.omega = 0.0;
   state.integ = 0.0;
@@ -147,6 +168,7 @@ resetBtn.addEventListener("click", () => { resetSim(); });
 kickBtn.addEventListener("click", () => {
   // 20 degrees ≈ 0.349 rad
   state.theta = clamp(state.theta + (Math.PI / 9), -Math.PI, Math.PI);
+  invalidateTrajectory();
 });
 
 zeroBtn.addEventListener("click", () => {
@@ -154,6 +176,7 @@ zeroBtn.addEventListener("click", () => {
   state.omega = 0.0;
   state.integ = 0.0;
   state.e_prev = 0.0;
+  invalidateTrajectory();
 });
 
 // -----------------------------
@@ -182,6 +205,7 @@ function applyDrag(ev){
 
   state.theta = clamp(theta, -Math.PI, Math.PI);
   state.omega = clamp(omega, -2.0, 2.0);
+  invalidateTrajectory();
 }
 
 world.addEventListener("mousedown", (ev) => { dragging = true; applyDrag(ev); });
@@ -209,6 +233,7 @@ suggestBtn.addEventListener("click", async () => {
     const out = await postJSON(`${API}/tune?style=${encodeURIComponent(style)}`, buildTunePayload());
     kp.value = out.kp; ki.value = out.ki; kd.value = out.kd;
     syncSliderText();
+    invalidateTrajectory();
     metaBox.textContent = JSON.stringify(out.meta, null, 2);
   }catch(e){
     metaBox.textContent = `Tune error: ${e}`;
@@ -217,23 +242,37 @@ suggestBtn.addEventListener("click", async () => {
 
 
 // -----------------------------
-// Control loop (deterministic, frequent)
+// Trajectory playback (deterministic, one /rollout per change)
+// Any change to gains, dt or state (drag, kick, reset...) drops the trajectory;
+// the next tick fetches a new one starting from the current state.
 // -----------------------------
-async function stepOnce(){
-  const payload = {
-    dt: Number(dtIn.value),
-    theta_ref: thetaRef,
+function invalidateTrajectory(){
+  traj = null;
+  trajGen++;
+}
+
+async function fetchTrajectory(){
+  const gen = trajGen;
+  const out = await postJSON(`${API}/rollout`, {
+    dt: simDt(),
     kp: Number(kp.value),
     ki: Number(ki.value),
     kd: Number(kd.value),
-    state,
-  };
-
-  const out = await postJSON(`${API}/control`, payload);
+    theta0: state.theta,
+    omega0: state.omega,
+    integ0: state.integ,
+    e_prev0: state.e_prev,
+    seconds: ROLLOUT_SECONDS,
+  });
+  if(gen !== trajGen) return;   // something changed while we were waiting
+  traj = out;
+  trajIdx = 0;
+}
 
-  state = out.state;
-  const e = out.error;
-  const u = out.u;
+// -----------------------------
+// Control loop (deterministic, frequent)
+// -----------------------------
+function recordStep(e, u){
   lastU = u;
 
   // buffers for plots
@@ -245,7 +284,7 @@ async function stepOnce(){
 
   // time + fuel
   if(!state.paused){
-    const dtv = Number(dtIn.value);
+    const dtv = simDt();
     simTime += dtv;
     fuel += Math.abs(u) * dtv;
   }
@@ -253,6 +292,41 @@ async function stepOnce(){
   pillState.textContent = `e=${fmt(e,2)} u=${fmt(u,2)}`;
 }
 
+async function stepOnce(){
+  if(state.paused){
+    const payload = {
+      dt: simDt(),
+      theta_ref: thetaRef,
+      kp: Number(kp.value),
+      ki: Number(ki.value),
+      kd: Number(kd.value),
+      state,
+    };
+
+    const out = await postJSON(`${API}/control`, payload);
+
+    state = out.state;
+    invalidateTrajectory();
+    recordStep(out.error, out.u);
+    return;
+  }
+
+  if(!traj || trajIdx >= traj.u.length){
+    await fetchTrajectory();
+    if(!traj) return;
+  }
+
+  const i = trajIdx++;
+  state = {
+    theta: traj.theta[i],
+    omega: traj.omega[i],
+    integ: traj.integ[i],
+    e_prev: traj.error[i],
+    paused: false,
+  };
+  recordStep(traj.error[i], traj.u[i]);
+}
+
 let stepping = false;
 setInterval(async () => {
   if(stepping) return;      // avoid overlap if network is slow
@@ -315,7 +389,7 @@ function drawWorld(){
   wctx.fillStyle = "rgba(230,238,252,0.86)";
   wctx.font = "13px ui-sans-serif, system-ui";
   wctx.fillText(
-    `t=${fmt(simTime,1)}s  fuel=${fmt(fuel,1)}  |  θ=${fmt(state.theta,2)} rad  ω=${fmt(state.omega,2)} rad/s  dt=${fmt(Number(dtIn.value),3)}`,
+    `t=${fmt(simTime,1)}s  fuel=${fmt(fuel,1)}  |  θ=${fmt(state.theta,2)} rad  ω=${fmt(state.omega,2)} rad/s  dt=${fmt(simDt(),3)}`,
     16, 22
   );
   wctx.fillStyle = "rgba(230,238,252,0.62)";